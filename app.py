@@ -1,31 +1,87 @@
 """Streamlit app for visualizing Dynare IRFs from MATLAB .mat files."""
 
-import base64
+import copy
+import functools
+import hashlib
 import io
 import math
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+import matplotlib
+
+# Headless app: no GUI toolkit, render everything through Agg
+matplotlib.use("Agg")
+
 import numpy as np
 import pandas as pd
 import scipy.io
 import streamlit as st
 import yaml
+from matplotlib import colors as mcolors
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.markers import MarkerStyle
+
+try:
+    # libyaml C bindings: much faster parse/emit on the rerun path
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
 
 import text
 from dynare_irf_utils import (
-    convert,
     dump_figure,
+    get_endo_names_all,
+    get_exo_names_all,
     get_irf,
     get_irf_endo_vars,
     load,
-    plot_irf_df,
 )
 
 type Mat = scipy.io.matlab.mat_struct
 
 
+@st.cache_data(show_spinner=False)
+def cached_load(file_bytes: bytes, fix_typo: bool = False) -> dict:
+    """MATファイルのバイト列をパースして返す(再実行時はキャッシュを利用)"""
+    data = load(io.BytesIO(file_bytes))
+    if fix_typo and "M_" in data:
+        # Run the typo fix once at load time so every rerun sees the
+        # corrected names straight from the cache
+        data["M_"] = fix_dynare_typo(data["M_"])
+    return data
+
+
+@st.cache_resource(show_spinner=False)
+def cached_get_irf(_oo_: Mat, _M_: Mat, cache_key: str) -> dict[str, pd.DataFrame]:
+    """IRFデータフレームの抽出(ファイルのダイジェストをキーにキャッシュ)
+
+    cache_resourceのため返り値は全rerunで共有される。変更してよいのは
+    冪等なしきい値処理(cached_shock_matrix内)だけ。
+    """
+    return get_irf(_oo_, _M_)
+
+
+@st.cache_data(show_spinner=False)
+def build_name_maps(_M_: Mat, cache_key: str) -> dict[str, dict[str, str]]:
+    """変数名・ショック名のlong↔short対応表を一度だけ構築
+
+    cached_loadは再実行ごとに新しいM_コピーを返すため、id()ではなく
+    ファイルのダイジェストをキーにする(cached_get_irfと同様)。
+    """
+    endo_short, endo_long = get_endo_names_all(_M_)
+    exo_short, exo_long = get_exo_names_all(_M_)
+    return {
+        "endo_long2short": dict(zip(endo_long, endo_short, strict=False)),
+        "endo_short2long": dict(zip(endo_short, endo_long, strict=False)),
+        "exo_long2short": dict(zip(exo_long, exo_short, strict=False)),
+        "exo_short2long": dict(zip(exo_short, exo_long, strict=False)),
+    }
+
+
 def remove_suptitle(fig: Figure) -> Figure:
     """Remove the suptitle from a matplotlib figure.
 
@@ -39,9 +95,13 @@ def remove_suptitle(fig: Figure) -> Figure:
         matplotlib.figure.Figure: The modified figure object.
 
     """
-    # Remove suptitle using the public API
+    # get_suptitle() returns "" when none was ever set or after
+    # suptitle(None), so this also keeps repeat calls cheap
+    if not fig.get_suptitle():
+        return fig
+    # Remove suptitle using the public API; the blank space it leaves is
+    # cropped by bbox_inches="tight" at export time, so no relayout here
     fig.suptitle(None)
-    fig.tight_layout()
     return fig
 
 
@@ -59,104 +119,177 @@ def get_mat_file(use_sample_file: bool, uploaded_file: object) -> tuple:
 
 
 def fix_dynare_typo(M_: Mat) -> Mat:
-    """Dynareファイルのtypo修正"""
-    target = "monetary policy shock"
-    replacement = "cost push shock"
-    M_.exo_names_long = [replacement if s == target else s for s in M_.exo_names_long]
-    return M_
-
-
-def get_endo_names_long(oo_: Mat, M_: Mat) -> list[str]:
+    """Dynareファイルのtypo修正(キャッシュ共有オブジェクトは変更しない)"""
+    names = [str(s) for s in M_.exo_names_long]
+    try:
+        names[names.index("monetary policy shock")] = "cost push shock"
+    except ValueError:
+        return M_
+    patched = copy.copy(M_)
+    patched.exo_names_long = names
+    return patched
+
+
+def get_endo_names_long(oo_: Mat, M_: Mat, digest: str) -> list[str]:
     """エンドジェナス変数名リストの取得"""
+    maps = build_name_maps(M_, digest)
     endo_vars_shocks = get_irf_endo_vars(oo_, M_)
     endo_vars = endo_vars_shocks[next(iter(endo_vars_shocks.keys()))]
-    endo_names_long = sorted(
-        [convert(name, M_, vartype="endo", length="long") for name in endo_vars],
-    )
+    endo_names_long = sorted(maps["endo_short2long"][name] for name in endo_vars)
     return endo_names_long
 
 
 def convert_selected_endo_names(
     selected_endo_names_long: list[str],
     M_: Mat,
+    digest: str,
 ) -> list[str]:
     """選択された変数名のshort name変換"""
+    maps = build_name_maps(M_, digest)
     return [
-        convert(long_name, M_, vartype="endo", length="short")
-        for long_name in selected_endo_names_long
+        maps["endo_long2short"][long_name] for long_name in selected_endo_names_long
     ]
 
 
-def get_shock_lists(
-    shock_dfs: dict[str, pd.DataFrame],
-    M_: Mat,
-) -> tuple[list[str], list[str]]:
-    """ショックリストの取得と変換"""
-    shock_list = list(shock_dfs.keys())
-    long_shock_list = [
-        convert(shock, M_, vartype="exo", length="long") for shock in shock_list
+@st.cache_data(show_spinner=False)
+def compute_common_endo(
+    _oo_list: list,
+    _M_list: list,
+    cache_key: tuple[str, ...],
+) -> tuple[str, ...]:
+    """全ファイル共通のエンドジェナス変数(long name)を求める"""
+    endo_names_long_sets = [
+        frozenset(get_endo_names_long(oo, M, digest))
+        for oo, M, digest in zip(_oo_list, _M_list, cache_key, strict=False)
     ]
-    return shock_list, long_shock_list
+    # Intersect smallest-first so the working set shrinks fastest
+    smallest_first = sorted(endo_names_long_sets, key=len)
+    # Tuples let the cached object be reused as-is as widget options
+    return tuple(sorted(functools.reduce(set.intersection, smallest_first)))
+
+
+@st.cache_data(show_spinner=False)
+def compute_common_shocks(
+    _shock_dfs_list: list,
+    cache_key: tuple[str, ...],
+) -> tuple[str, ...]:
+    """全ファイル共通のショック名を求める"""
+    shock_list_sets = sorted(
+        (frozenset(dfs.keys()) for dfs in _shock_dfs_list),
+        key=len,
+    )
+    return tuple(sorted(functools.reduce(set.intersection, shock_list_sets)))
+
+
+@st.cache_data(show_spinner=False)
+def compute_long_shock_list(
+    _M_: Mat,
+    common_shocks: tuple[str, ...],
+    cache_key: str,
+) -> tuple[str, ...]:
+    """共通ショック名のlong name変換(ファイル単位でキャッシュ)"""
+    maps = build_name_maps(_M_, cache_key)
+    return tuple(maps["exo_short2long"][shock] for shock in common_shocks)
+
+
+@st.cache_data(show_spinner=False)
+def parse_options_yaml(raw: bytes) -> dict:
+    """アップロードされたYAMLを解析(同じ内容の間はキャッシュ)"""
+    return yaml.load(io.BytesIO(raw), Loader=SafeLoader)
+
+
+@st.cache_data(show_spinner=False)
+def render_options_yaml(plot_options: dict) -> bytes:
+    """プロットオプションをYAMLバイト列へ変換(値が同じ間はキャッシュ)"""
+    yaml_str = yaml.dump(
+        plot_options,
+        Dumper=SafeDumper,
+        allow_unicode=True,
+        sort_keys=False,
+    )
+    return yaml_str.encode("utf-8")
+
+
+def get_figure_grid(n_rows: int, n_col: int, width: float, height: float) -> tuple:
+    """サブプロットグリッドを生成(同一セッション・同一レイアウトの間は図を再利用)
+
+    図は描画のたびに書き換わるmutableな資源なので、cache_resourceの
+    プロセス共有ではなくsession_stateに保持してセッション間で分離する。
+    """
+    grid_key = (n_rows, n_col, width, height)
+    cached = ss.get("_figure_grid")
+    if cached is not None and cached[0] == grid_key:
+        return cached[1], cached[2]
+    # Build the figure outside pyplot so it never lands in the Gcf
+    # registry, which would pin every cached grid for the process lifetime
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    # squeeze=False: axes is always a 2-D ndarray, whatever the grid shape
+    axes = fig.subplots(n_rows, n_col, squeeze=False)
+    ss["_figure_grid"] = (grid_key, fig, axes)
+    return fig, axes
 
 
 plot_threshold = 1e-10
 
 
-def plot_and_download_irf(
-    irf_data_list: list,
-    var_names: list,
-    shock_names: list,
-    style_options: list,
-    legend_labels: list,
-    legend_panel_mode: int,
-    show_grid: bool,
-    fig_width: float,
-    fig_height: float,
-    download_yaml: bool,
-    save_options: dict,
-) -> None:
-    """IRFプロットとダウンロード処理"""
-    fig = plot_irf_df(
-        irf_data_list,
-        var_names,
-        shock_names,
-        n_cols=style_options["n_col"],
-        M_=style_options["M_"],
-        xlabel=style_options["xlabel"],
-        ylabel=style_options["ylabel"],
-        irf_threshold=plot_threshold,
-    )
-    st.pyplot(fig)
-    with st.expander("Display IRF Data"):
-        st.write(irf_data_list)
-    base_file_name = f"{save_options['mat_file_name']}_{shock_names}"
-    fig_for_save = fig if save_options["fig_title"] else remove_suptitle(fig)
-    if save_options["file_format"] == "pkl":
-        pkl_bytes = dump_figure(fig_for_save)
-        st.download_button(
-            label="Download as pkl",
-            data=pkl_bytes,
-            file_name=f"{base_file_name}.pkl",
-            mime="application/octet-stream",
-        )
-        with st.expander("About the PKL File"):
-            st.markdown(text.about_pkl())
+def apply_plot_threshold(df: pd.DataFrame, threshold: float) -> None:
+    """ピーク絶対値がしきい値未満の列をまとめてゼロにする(単一パス)"""
+    # IRF frames are float-homogeneous (single block), so
+    # to_numpy(copy=False) reads the data without copying.
+    # Under pandas copy-on-write the view is read-only, so
+    # the write-back goes through one masked loc assignment.
+    mat = df.to_numpy(copy=False)
+    zero_cols = np.nanmax(np.abs(mat), axis=0) < threshold
+    if zero_cols.any():
+        df.loc[:, zero_cols] = 0.0
+
+
+@st.cache_data(show_spinner=False)
+def cached_shock_matrix(
+    _irf_dfs: dict,
+    shock_name: str,
+    threshold: float,
+    cache_key: str,
+) -> tuple:
+    """ショックのIRF行列・列インデックス・x軸をndarrayで一度だけ構築
+
+    しきい値処理もここで適用されるため、再実行時はキャッシュ取得のみ。
+    """
+    df = _irf_dfs[shock_name]
+    apply_plot_threshold(df, threshold)
+    col_idx = {name: i for i, name in enumerate(df.columns)}
+    return df, df.to_numpy(), col_idx, df.index.to_numpy()
+
+
+def export_figure_bytes(fig: Figure, file_format: str) -> bytes:
+    """図を指定形式で書き出してバイト列を返す"""
+    # Sessions run on separate threads, so the buffer is per-call; its
+    # allocation is noise next to savefig itself
+    buf = io.BytesIO()
+    save_kwargs = {"metadata": {}}
+    if file_format == "png":
+        # Interactive export: favor encode speed over compression ratio
+        save_kwargs["pil_kwargs"] = {"compress_level": 1, "optimize": False}
     else:
-        buffer = io.BytesIO()
-        fig_for_save.savefig(buffer, format=save_options["file_format"])
-        buffer.seek(0)
-        mime_type = {
-            "png": "image/png",
-            "eps": "application/postscript",
-            "pdf": "application/pdf",
-            "svg": "image/svg+xml",
-        }[save_options["file_format"]]
-        st.download_button(
-            label=f"Download as {save_options['file_format']}",
-            data=buffer,
-            file_name=f"{base_file_name}.{save_options['file_format']}",
-            mime=mime_type,
-        )
+        # Cap the resolution of rasterized artists in vector formats
+        save_kwargs["dpi"] = 120
+    fig.savefig(
+        buf,
+        format=file_format,
+        bbox_inches="tight",
+        pad_inches=0.05,
+        **save_kwargs,
+    )
+    return buf.getvalue()
+
+
+@st.cache_data(show_spinner=False)
+def encode_figure(_fig: Figure, plot_sig: tuple, file_format: str) -> bytes:
+    """図のエンコード結果をプロット入力+形式をキーにキャッシュ"""
+    if file_format == "pkl":
+        return dump_figure(_fig)
+    return export_figure_bytes(_fig, file_format)
 
 
 # --- メイン処理 ---
@@ -165,6 +298,9 @@ st.set_page_config(
     page_icon="📈",
 )
 
+# Grab the session-state proxy once; all state access below goes through it
+ss = st.session_state
+
 st.title("IRF Plotter for MAT Files")
 st.markdown(text.tool_description())
 with st.expander("How to Use"):
@@ -185,200 +321,218 @@ if not use_sample_file:
         accept_multiple_files=True,
     )
 
-mat_file_paths = []
+mat_file_bytes = []
 mat_file_names = []
 if use_sample_file:
     mat_file_path, mat_file_name = get_mat_file(use_sample_file, None)
     if mat_file_path:
-        mat_file_paths = [mat_file_path]
+        mat_file_bytes = [Path(mat_file_path).read_bytes()]
         mat_file_names = [mat_file_name or "sample"]
 elif uploaded_files:
     for f in uploaded_files:
         path, name = get_mat_file(use_sample_file, f)
         if path:
-            mat_file_paths.append(path)
+            mat_file_bytes.append(f.getvalue())
             mat_file_names.append(name or Path(f.name).stem)
 
-if mat_file_paths:
-    datas = [load(path) for path in mat_file_paths]
+if mat_file_bytes:
+    mat_file_digests = [hashlib.md5(b).hexdigest() for b in mat_file_bytes]
+    datas = [cached_load(b, fix_typo=use_sample_file) for b in mat_file_bytes]
     oo_list = [d.get("oo_", None) for d in datas]
     M_list = [d.get("M_", None) for d in datas]
-    if use_sample_file:
-        M_list = [fix_dynare_typo(M_) for M_ in M_list]
 
     if any(oo is None for oo in oo_list):
         st.error("At least one MAT file does not contain 'oo_' data.")
     else:
         # Variable and shock selection
-        endo_names_long_sets = [
-            set(get_endo_names_long(oo, M))
-            for oo, M in zip(oo_list, M_list, strict=False)
-        ]
-        common_endo_names_long = sorted(set.intersection(*endo_names_long_sets))
+        common_endo_names_long = compute_common_endo(
+            oo_list,
+            M_list,
+            tuple(mat_file_digests),
+        )
         selected_endo_names_long = st.multiselect(
             "Select endogenous variables to plot:",
             options=common_endo_names_long,
-            default=st.session_state.get(
+            default=ss.get(
                 "selected_endo_names_long",
-                common_endo_names_long[:],
+                common_endo_names_long,
             ),
         )
         if selected_endo_names_long:
             selected_endo_names_short_list = [
-                convert_selected_endo_names(selected_endo_names_long, M) for M in M_list
+                convert_selected_endo_names(selected_endo_names_long, M, digest)
+                for M, digest in zip(M_list, mat_file_digests, strict=False)
             ]
             shock_dfs_list = [
-                get_irf(oo, M) for oo, M in zip(oo_list, M_list, strict=False)
-            ]
-            shock_list_sets = [set(dfs.keys()) for dfs in shock_dfs_list]
-            common_shocks = sorted(set.intersection(*shock_list_sets))
-            long_shock_list = [
-                convert(shock, M_list[0], vartype="exo", length="long")
-                for shock in common_shocks
+                cached_get_irf(oo, M, digest)
+                for oo, M, digest in zip(
+                    oo_list,
+                    M_list,
+                    mat_file_digests,
+                    strict=False,
+                )
             ]
+            common_shocks = compute_common_shocks(
+                shock_dfs_list,
+                tuple(mat_file_digests),
+            )
+            name_maps = build_name_maps(M_list[0], mat_file_digests[0])
+            long_shock_list = compute_long_shock_list(
+                M_list[0],
+                common_shocks,
+                mat_file_digests[0],
+            )
+            long_shock_idx = {name: i for i, name in enumerate(long_shock_list)}
             selected_shock_long = st.selectbox(
                 "Select shocks to plot:",
                 options=long_shock_list,
-                index=(
-                    long_shock_list.index(st.session_state["selected_shock_long"])
-                    if "selected_shock_long" in st.session_state
-                    and st.session_state["selected_shock_long"] in long_shock_list
-                    else 0
-                ),
+                index=long_shock_idx.get(ss.get("selected_shock_long"), 0),
             )
-            with st.expander("Plot Options"):
-                n_col = st.number_input(
-                    "Number of columns for the plot layout:",
-                    min_value=1,
-                    max_value=5,
-                    value=st.session_state.get("n_col", 2),
-                    step=1,
-                )
-                plot_xlabel = st.text_input(
-                    "X-axis label:",
-                    value=st.session_state.get("plot_xlabel", "Time"),
-                )
-                plot_ylabel = st.text_input(
-                    "Y-axis label:",
-                    value=st.session_state.get("plot_ylabel", "Response"),
-                )
-                periods = st.number_input(
-                    "Number of periods to plot:",
-                    min_value=1,
-                    max_value=100,
-                    value=st.session_state.get(
-                        "periods",
-                        len(shock_dfs_list[0][common_shocks[0]]),
-                    ),
-                    step=1,
+            # Default periods: recompute only when the file set changes
+            digests_key = tuple(mat_file_digests)
+            if ss.get("_n_periods_files") != digests_key:
+                ss["_n_periods_files"] = digests_key
+                ss["_n_periods_default"] = len(
+                    shock_dfs_list[0][common_shocks[0]],
                 )
-            # --- Per-MAT file plot style options ---
-            marker_choices = ["o", "s", "^", "D", "v", "x", "*", "+", ".", "None"]
-            linestyle_choices = ["-", "--", "-.", ":"]
-            color_choices = [
-                "blue",
-                "orange",
-                "green",
-                "red",
-                "purple",
-                "brown",
-                "pink",
-                "gray",
-                "olive",
-                "cyan",
-            ]
-            file_plot_options = []
-            st.markdown("### Plot Style for Each MAT File")
-            loaded_file_opts = st.session_state.get(
-                "file_plot_options",
-                [{} for _ in mat_file_names],
-            )
-            if isinstance(loaded_file_opts, tuple):
-                loaded_file_opts = loaded_file_opts[0]
-            for idx, name in enumerate(mat_file_names):
-                with st.expander(f"Style for {name}"):
-                    marker = st.selectbox(
-                        f"Marker for {name}",
-                        marker_choices,
-                        index=(
-                            marker_choices.index(loaded_file_opts[idx]["marker"])
-                            if idx < len(loaded_file_opts)
-                            and loaded_file_opts[idx].get("marker") in marker_choices
-                            else idx % len(marker_choices)
-                        ),
-                        key=f"marker_{idx}",
+            n_periods_default = ss["_n_periods_default"]
+            # Batch style tweaks into one rerun: values below only take
+            # effect when the form is submitted
+            with st.form("plot_options_form"):
+                with st.expander("Plot Options"):
+                    n_col = st.number_input(
+                        "Number of columns for the plot layout:",
+                        min_value=1,
+                        max_value=5,
+                        value=ss.get("n_col", 2),
+                        step=1,
                     )
-                    linestyle = st.selectbox(
-                        f"Line style for {name}",
-                        linestyle_choices,
-                        index=(
-                            linestyle_choices.index(loaded_file_opts[idx]["linestyle"])
-                            if idx < len(loaded_file_opts)
-                            and loaded_file_opts[idx].get("linestyle")
-                            in linestyle_choices
-                            else 0
-                        ),
-                        key=f"linestyle_{idx}",
+                    plot_xlabel = st.text_input(
+                        "X-axis label:",
+                        value=ss.get("plot_xlabel", "Time"),
                     )
-                    color = st.selectbox(
-                        f"Color for {name}",
-                        color_choices,
-                        index=(
-                            color_choices.index(loaded_file_opts[idx]["color"])
-                            if idx < len(loaded_file_opts)
-                            and loaded_file_opts[idx].get("color") in color_choices
-                            else idx % len(color_choices)
-                        ),
-                        key=f"color_{idx}",
+                    plot_ylabel = st.text_input(
+                        "Y-axis label:",
+                        value=ss.get("plot_ylabel", "Response"),
                     )
-                    legend_label = st.text_input(
-                        f"Legend label for {name}",
-                        value=(
-                            loaded_file_opts[idx]["legend_label"]
-                            if idx < len(loaded_file_opts)
-                            and loaded_file_opts[idx].get("legend_label")
-                            else name
-                        ),
-                        key=f"legend_{idx}",
+                    periods = st.number_input(
+                        "Number of periods to plot:",
+                        min_value=1,
+                        max_value=100,
+                        value=ss.get("periods", n_periods_default),
+                        step=1,
                     )
-                    file_plot_options.append(
-                        {
-                            "marker": marker if marker != "None" else None,
-                            "linestyle": linestyle,
-                            "color": color,
-                            "legend_label": legend_label,
-                        },
+                # --- Per-MAT file plot style options ---
+                marker_choices = ["o", "s", "^", "D", "v", "x", "*", "+", ".", "None"]
+                linestyle_choices = ["-", "--", "-.", ":"]
+                color_choices = [
+                    "blue",
+                    "orange",
+                    "green",
+                    "red",
+                    "purple",
+                    "brown",
+                    "pink",
+                    "gray",
+                    "olive",
+                    "cyan",
+                ]
+                # O(1) choice->index lookups for the widget defaults below
+                marker_idx = {m: i for i, m in enumerate(marker_choices)}
+                linestyle_idx = {ls: i for i, ls in enumerate(linestyle_choices)}
+                color_idx = {c: i for i, c in enumerate(color_choices)}
+                file_plot_options = []
+                st.markdown("### Plot Style for Each MAT File")
+                loaded_file_opts = ss.get(
+                    "file_plot_options",
+                    [{} for _ in mat_file_names],
+                )
+                if isinstance(loaded_file_opts, tuple):
+                    loaded_file_opts = loaded_file_opts[0]
+                # Extract the saved defaults once instead of four .get() chains
+                # per file inside the widget loop
+                style_defaults = [
+                    (
+                        o.get("marker"),
+                        o.get("linestyle"),
+                        o.get("color"),
+                        o.get("legend_label"),
                     )
-            show_legend = st.checkbox(
-                "Show legend",
-                value=st.session_state.get("show_legend", True),
-            )
-            legend_panel_mode = st.selectbox(
-                "Legend display mode:",
-                options=[0, 1],
-                index=st.session_state.get("legend_panel_mode", 0),
-                format_func=lambda x: "all panels" if x == 0 else "first panel only",
-            )
-            n_vars = len(selected_endo_names_long)
-            n_rows = math.ceil(n_vars / n_col)
-            show_grid = st.checkbox(
-                "Show grid",
-                value=st.session_state.get("show_grid", False),
-            )
-            fig_width = st.number_input(
-                "Figure width (inches)",
-                min_value=4,
-                max_value=24,
-                value=st.session_state.get("fig_width", 5 * n_col),
-                step=1,
-            )
-            fig_height = st.number_input(
-                "Figure height (inches)",
-                min_value=3,
-                max_value=20,
-                value=st.session_state.get("fig_height", 3 * n_rows),
-                step=1,
-            )
+                    for o in loaded_file_opts
+                ]
+                for idx, name in enumerate(mat_file_names):
+                    saved_marker, saved_linestyle, saved_color, saved_label = (
+                        style_defaults[idx]
+                        if idx < len(style_defaults)
+                        else (None,) * 4
+                    )
+                    with st.expander(f"Style for {name}"):
+                        marker = st.selectbox(
+                            f"Marker for {name}",
+                            marker_choices,
+                            index=marker_idx.get(
+                                saved_marker, idx % len(marker_choices)
+                            ),
+                            key=f"marker_{idx}",
+                        )
+                        linestyle = st.selectbox(
+                            f"Line style for {name}",
+                            linestyle_choices,
+                            index=linestyle_idx.get(saved_linestyle, 0),
+                            key=f"linestyle_{idx}",
+                        )
+                        color = st.selectbox(
+                            f"Color for {name}",
+                            color_choices,
+                            index=color_idx.get(saved_color, idx % len(color_choices)),
+                            key=f"color_{idx}",
+                        )
+                        legend_label = st.text_input(
+                            f"Legend label for {name}",
+                            value=saved_label if saved_label else name,
+                            key=f"legend_{idx}",
+                        )
+                        file_plot_options.append(
+                            {
+                                "marker": marker if marker != "None" else None,
+                                "linestyle": linestyle,
+                                "color": color,
+                                "legend_label": legend_label,
+                            },
+                        )
+                show_legend = st.checkbox(
+                    "Show legend",
+                    value=ss.get("show_legend", True),
+                )
+                legend_panel_mode = st.selectbox(
+                    "Legend display mode:",
+                    options=[0, 1],
+                    index=ss.get("legend_panel_mode", 0),
+                    format_func=lambda x: (
+                        "all panels" if x == 0 else "first panel only"
+                    ),
+                )
+                n_vars = len(selected_endo_names_long)
+                n_rows = math.ceil(n_vars / n_col)
+                show_grid = st.checkbox(
+                    "Show grid",
+                    value=ss.get("show_grid", False),
+                )
+                fig_width = st.number_input(
+                    "Figure width (inches)",
+                    min_value=4,
+                    max_value=24,
+                    value=ss.get("fig_width", 5 * n_col),
+                    step=1,
+                )
+                fig_height = st.number_input(
+                    "Figure height (inches)",
+                    min_value=3,
+                    max_value=20,
+                    value=ss.get("fig_height", 3 * n_rows),
+                    step=1,
+                )
+                st.form_submit_button("Apply plot options")
             # --- Save/Load Plot Options (YAML) UI ---
             st.markdown("#### Save/Load Plot Options (YAML)")
             # --- Load (YAML upload) UI ---
@@ -392,7 +546,7 @@ if mat_file_paths:
             rerun_flag = "yaml_needs_rerun"
             if load_yaml_file is not None:
                 try:
-                    loaded = yaml.safe_load(load_yaml_file)
+                    loaded = parse_options_yaml(load_yaml_file.getvalue())
                     legend_mode = loaded.get("legend_panel_mode", 0)
                     if not isinstance(legend_mode, int) or legend_mode not in (0, 1):
                         legend_mode = 0
@@ -400,30 +554,30 @@ if mat_file_paths:
                         if k in ("endo_names_long", "shock_names"):
                             continue
                         if k == "legend_panel_mode":
-                            st.session_state[k] = legend_mode
+                            ss[k] = legend_mode
                         else:
-                            st.session_state[k] = v
-                    st.session_state[rerun_flag] = True
+                            ss[k] = v
+                    ss[rerun_flag] = True
                 except yaml.YAMLError as e:
                     yaml_load_error = True
                     st.error(
                         f"YAML file is invalid and was not loaded. Reason: {e}",
                     )
                     st.info("Please select a valid YAML file.")
-                    st.session_state[rerun_key] = False  # Reset flag on error
-                    st.session_state[rerun_flag] = False
+                    ss[rerun_key] = False  # Reset flag on error
+                    ss[rerun_flag] = False
             else:
-                st.session_state[rerun_key] = False
-                st.session_state[rerun_flag] = False
+                ss[rerun_key] = False
+                ss[rerun_flag] = False
 
             # Show redraw button after YAML load
-            if st.session_state.get(rerun_flag, False) and not yaml_load_error:
+            if ss.get(rerun_flag, False) and not yaml_load_error:
                 st.warning(
                     "To apply the loaded YAML settings, "
                     "please click the redraw button below.",
                 )
                 if st.button("Redraw"):
-                    st.session_state[rerun_flag] = False
+                    ss[rerun_flag] = False
                     st.rerun()
             # --- Save (YAML download) UI ---
             st.markdown("#### Save Plot Options (YAML Download)")
@@ -460,119 +614,181 @@ if mat_file_paths:
                     plot_options[var] = val
                 elif var in locals():
                     plot_options[var] = locals()[var]
-            yaml_str = yaml.dump(plot_options, allow_unicode=True, sort_keys=False)
-            b64 = base64.b64encode(yaml_str.encode()).decode()
-            download_link = (
-                f'<a href="data:text/yaml;base64,{b64}" '
-                'download="irf_plot_options.yaml">Download YAML</a>'
+            st.download_button(
+                "Download YAML",
+                data=render_options_yaml(plot_options),
+                file_name="irf_plot_options.yaml",
+                mime="application/x-yaml",
             )
-            st.markdown(download_link, unsafe_allow_html=True)
 
             # --- Drawing and saving ---
             if selected_shock_long:
-                shock_name = convert(
-                    selected_shock_long,
-                    M_list[0],
-                    vartype="exo",
-                    length="short",
-                )
+                shock_name = name_maps["exo_long2short"][selected_shock_long]
                 st.subheader(f"Shock: {selected_shock_long}")
-                include_title = st.checkbox(
-                    "Include figure title in the exported file",
-                    value=True,
-                )
-                file_format = st.selectbox(
-                    "Select file format to download:",
-                    options=["png", "pdf", "eps", "svg", "pkl"],
+                # Batch the export tweaks as well: title toggle + format
+                # commit together instead of one rerun each
+                with st.form("export_form"):
+                    include_title = st.checkbox(
+                        "Include figure title in the exported file",
+                        value=True,
+                    )
+                    file_format = st.selectbox(
+                        "Select file format to download:",
+                        options=["png", "pdf", "eps", "svg", "pkl"],
+                    )
+                    st.form_submit_button("Render & prepare download")
+                # Thresholded matrices, column indexes and x axes come out
+                # of the cache as plain ndarrays; pandas only reappears for
+                # the data expander below
+                sliced_frames = []
+                x_arrays = []
+                irf_mats = []
+                for irf_dfs, endo_short, digest in zip(
+                    shock_dfs_list,
+                    selected_endo_names_short_list,
+                    mat_file_digests,
+                    strict=False,
+                ):
+                    df, values, col_idx, x_full = cached_shock_matrix(
+                        irf_dfs,
+                        shock_name,
+                        plot_threshold,
+                        digest,
+                    )
+                    sliced_frames.append(df.iloc[:periods])
+                    x_arrays.append(x_full[:periods])
+                    irf_mats.append(
+                        values[:periods, [col_idx[c] for c in endo_short]],
+                    )
+                # Redraw only when something that affects the figure changed;
+                # otherwise st.pyplot below reuses the cached figure as-is
+                plot_sig = (
+                    digests_key,
+                    shock_name,
+                    tuple(selected_endo_names_long),
+                    n_col,
+                    plot_xlabel,
+                    plot_ylabel,
+                    periods,
+                    tuple(
+                        (
+                            opt["marker"],
+                            opt["linestyle"],
+                            opt["color"],
+                            opt["legend_label"],
+                        )
+                        for opt in file_plot_options
+                    ),
+                    show_legend,
+                    legend_panel_mode,
+                    show_grid,
+                    fig_width,
+                    fig_height,
+                    include_title,
                 )
-                # --- IRF thresholding for direct matplotlib plotting ---
-                for irf_dfs in shock_dfs_list:
-                    df = irf_dfs[shock_name]
-                    for col in df.columns:
-                        arr = df[col].to_numpy().copy()
-                        if np.nanmax(np.abs(arr)) < plot_threshold:
-                            arr[:] = 0
-                            df[col] = arr
-                fig, axes = plt.subplots(n_rows, n_col, figsize=(fig_width, fig_height))
-                if n_vars == 1:
-                    axes = [[axes]]
-                elif n_rows == 1:
-                    axes = [axes]
-                elif n_col == 1:
-                    axes = [[ax] for ax in axes]
-                else:
-                    axes = axes.reshape((n_rows, n_col))
-                for idx_var, var_long in enumerate(selected_endo_names_long):
-                    row = idx_var // n_col
-                    col = idx_var % n_col
-                    ax = axes[row][col]
-                    for irf_dfs, endo_short, plot_opt in zip(
-                        shock_dfs_list,
-                        selected_endo_names_short_list,
-                        file_plot_options,
-                        strict=False,
-                    ):
-                        var_short = endo_short[idx_var]
-                        irfs = irf_dfs[shock_name][:periods]
-                        ax.plot(
-                            irfs.index,
-                            irfs[var_short],
-                            label=(
-                                plot_opt["legend_label"]
-                                if show_legend
-                                and (
-                                    legend_panel_mode == 0
-                                    or (legend_panel_mode == 1 and idx_var == 0)
-                                )
-                                else None
-                            ),
+                redraw = ss.get("_plot_sig") != plot_sig
+                fig, axes = get_figure_grid(n_rows, n_col, fig_width, fig_height)
+                if redraw:
+                    # Reused figure: wipe the previous rerun's artists and title
+                    for ax in fig.axes:
+                        ax.clear()
+                    fig.suptitle(None)
+                    # Proxy handles so the legend survives the LineCollection
+                    # batching below (collections have no per-line handles)
+                    legend_handles = [
+                        Line2D(
+                            [],
+                            [],
                             marker=plot_opt["marker"],
                             linestyle=plot_opt["linestyle"],
                             color=plot_opt["color"],
+                            label=plot_opt["legend_label"],
                         )
-                    if show_grid:
-                        ax.grid(visible=True)
-                    ax.set_title(var_long)
-                    ax.set_xlabel(plot_xlabel)
-                    ax.set_ylabel(plot_ylabel)
-                    if show_legend and (
-                        legend_panel_mode == 0
-                        or (legend_panel_mode == 1 and idx_var == 0)
+                        for plot_opt in file_plot_options
+                    ]
+                    # Parse each file's style strings once; every panel
+                    # reuses the validated marker/color objects
+                    file_styles = [
+                        (
+                            MarkerStyle(opt["marker"]) if opt["marker"] else None,
+                            opt["linestyle"],
+                            mcolors.to_rgba(opt["color"]),
+                        )
+                        for opt in file_plot_options
+                    ]
+                    per_file = list(
+                        zip(x_arrays, irf_mats, file_styles, strict=False),
+                    )
+                    # Dense plots: rasterize the artists so vector exports
+                    # embed one image per panel instead of every segment
+                    rasterize = periods * len(per_file) * n_vars > 2000
+                    for idx_var, (ax, var_long) in enumerate(
+                        zip(axes.flat, selected_endo_names_long, strict=False),
                     ):
-                        ax.legend()
-                # Hide unused subplots
-                for idx in range(n_vars, n_rows * n_col):
-                    row = idx // n_col
-                    col = idx % n_col
-                    axes[row][col].axis("off")
-                if include_title:
-                    fig.suptitle(f"IRFs for shock: {selected_shock_long}")
-                fig.tight_layout(rect=[0, 0.03, 1, 0.95] if include_title else None)
+                        segments = []
+                        seg_colors = []
+                        seg_linestyles = []
+                        for x, irf_mat, (marker, linestyle, color) in per_file:
+                            y = irf_mat[:, idx_var]
+                            segments.append(np.column_stack([x, y]))
+                            seg_colors.append(color)
+                            seg_linestyles.append(linestyle)
+                            if marker is not None:
+                                ax.scatter(
+                                    x,
+                                    y,
+                                    marker=marker,
+                                    color=color,
+                                    rasterized=rasterize,
+                                )
+                        ax.add_collection(
+                            LineCollection(
+                                segments,
+                                colors=seg_colors,
+                                linestyles=seg_linestyles,
+                                rasterized=rasterize,
+                            ),
+                        )
+                        ax.autoscale_view()
+                        if show_grid:
+                            ax.grid(visible=True)
+                        ax.set_title(var_long)
+                        ax.set_xlabel(plot_xlabel)
+                        ax.set_ylabel(plot_ylabel)
+                        if show_legend and (
+                            legend_panel_mode == 0
+                            or (legend_panel_mode == 1 and idx_var == 0)
+                        ):
+                            ax.legend(handles=legend_handles)
+                    # Hide unused subplots
+                    for ax in axes.flat[n_vars:]:
+                        ax.axis("off")
+                    if include_title:
+                        fig.suptitle(f"IRFs for shock: {selected_shock_long}")
+                    fig.tight_layout(rect=[0, 0.03, 1, 0.95] if include_title else None)
+                    ss["_plot_sig"] = plot_sig
                 st.pyplot(fig)
                 with st.expander("Display IRF Data"):
-                    for mat_name, irf_dfs in zip(
+                    for mat_name, sliced in zip(
                         mat_file_names,
-                        shock_dfs_list,
+                        sliced_frames,
                         strict=False,
                     ):
                         st.write(f"{mat_name}")
-                        st.write(irf_dfs[shock_name][:periods])
+                        st.write(sliced)
                 base_file_name = f"{'_'.join(mat_file_names)}_{shock_name}"
                 fig_for_save = fig if include_title else remove_suptitle(fig)
+                encoded = encode_figure(fig_for_save, plot_sig, file_format)
                 if file_format == "pkl":
-                    pkl_bytes = dump_figure(fig_for_save)
                     st.download_button(
                         label="Download as pkl",
-                        data=pkl_bytes,
+                        data=encoded,
                         file_name=f"{base_file_name}.pkl",
                         mime="application/octet-stream",
                     )
                     with st.expander("About the PKL File"):
                         st.markdown(text.about_pkl())
                 else:
-                    buffer = io.BytesIO()
-                    fig_for_save.savefig(buffer, format=file_format)
-                    buffer.seek(0)
                     mime_type = {
                         "png": "image/png",
                         "eps": "application/postscript",
@@ -581,7 +797,7 @@ if mat_file_paths:
                     }[file_format]
                     st.download_button(
                         label=f"Download as {file_format}",
-                        data=buffer,
+                        data=encoded,
                         file_name=f"{base_file_name}.{file_format}",
                         mime=mime_type,
                     )
@@ -3,24 +3,49 @@
 (Impulse Response Function) data.
 """
 
+from __future__ import annotations
+
+import functools
 import math
+import os
 import pickle
 from collections import defaultdict
+from typing import TYPE_CHECKING
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from matplotlib.figure import Figure
 from scipy.io import loadmat
 from scipy.io.matlab import mat_struct
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+
+@functools.lru_cache(maxsize=8)
+def _load_cached(path: str, _mtime: float) -> dict[mat_struct]:
+    return loadmat(path, squeeze_me=True, struct_as_record=False)
+
 
 def load(filename: str) -> dict[mat_struct]:
-    """Load a .mat file and return the data."""
+    """Load a .mat file and return the data.
+
+    Repeat loads of an unchanged on-disk file are served from a small
+    cache keyed on path and mtime, so callers should treat the result as
+    read-only. File-like objects are parsed directly.
+    """
+    if isinstance(filename, (str, os.PathLike)):
+        path = os.path.abspath(filename)
+        return _load_cached(path, os.path.getmtime(path))
     return loadmat(filename, squeeze_me=True, struct_as_record=False)
 
 
+@functools.lru_cache(maxsize=16)
+def _decoded_names(_M_id: int, M_: mat_struct, attr: str) -> tuple[str, ...]:
+    """Decode one of M_'s name arrays to stripped strings, once per struct."""
+    names = np.atleast_1d(getattr(M_, attr))
+    return tuple(np.char.strip(names.astype(np.str_)).tolist())
+
+
 def get_endo_names(M_: mat_struct, long: bool = False) -> list[str]:
     """Extract endogenous variable names from M_.
 
@@ -28,11 +53,11 @@ def get_endo_names(M_: mat_struct, long: bool = False) -> list[str]:
     """
     if long:
         if hasattr(M_, "endo_names_long"):
-            return [str(name).strip() for name in np.atleast_1d(M_.endo_names_long)]
+            return list(_decoded_names(id(M_), M_, "endo_names_long"))
         msg = "Missing attribute: endo_names_long"
         raise AttributeError(msg)
     if hasattr(M_, "endo_names"):
-        return [str(name).strip() for name in np.atleast_1d(M_.endo_names)]
+        return list(_decoded_names(id(M_), M_, "endo_names"))
     msg = "M_ does not have 'endo_names' attribute."
     raise AttributeError(msg)
 
@@ -51,13 +76,13 @@ def get_exo_names(M_: mat_struct, long=False) -> list[str]:
     """Extract shock names from M_."""
     if long:
         if hasattr(M_, "exo_names_long"):
-            return [str(name).strip() for name in np.atleast_1d(M_.exo_names_long)]
+            return list(_decoded_names(id(M_), M_, "exo_names_long"))
         msg = "M_ does not have 'exo_names_long' attribute."
         raise AttributeError(msg)
     if not hasattr(M_, "exo_names"):
         msg = "M_ does not have 'exo_names' attribute."
         raise AttributeError(msg)
-    return [str(name).strip() for name in np.atleast_1d(M_.exo_names)]
+    return list(_decoded_names(id(M_), M_, "exo_names"))
 
 
 def get_exo_names_all(M_: mat_struct) -> tuple[list[str], list[str]]:
@@ -70,6 +95,51 @@ def get_exo_names_all(M_: mat_struct) -> tuple[list[str], list[str]]:
     return short, long
 
 
+def _group_irfs(
+    oo_: mat_struct,
+    M_: mat_struct,
+) -> tuple[dict[str, list[str]], dict[str, np.ndarray]]:
+    """Scan oo_.irfs once, grouping variable names by shock.
+
+    Shared by get_irf_endo_vars and get_irf so the attribute walk and the
+    IRF dictionary are built in a single pass.
+    """
+    irfs = oo_.irfs
+
+    # Get variable names and shock names as sets for O(1) membership tests
+    endo_set = set(get_endo_names(M_, long=False))
+    shock_set = set(get_exo_names(M_, long=False))
+
+    # mat_struct keeps its fields in __dict__, so vars() skips the
+    # inherited attributes dir() would list
+    irf_dict = {}
+    used_vars_by_shock = defaultdict(set)
+    for full_name, value in vars(irfs).items():
+        if not isinstance(value, np.ndarray):
+            continue
+        irf_dict[full_name] = value
+        # Split "<var>_<shock>" at each underscore, longest shock
+        # suffix first, instead of testing every shock name per entry
+        idx = full_name.find("_")
+        while idx != -1:
+            shock = full_name[idx + 1 :]
+            if shock in shock_set:
+                var = full_name[:idx]
+                if var in endo_set:
+                    used_vars_by_shock[shock].add(var)
+                break
+            idx = full_name.find("_", idx + 1)
+
+    if not used_vars_by_shock:
+        msg = "No IRF variable names found for the given shocks."
+        raise ValueError(msg)
+
+    # Sets deduplicate as we go; sort each shock's variables once at the end
+    return {
+        shock: sorted(vars_) for shock, vars_ in used_vars_by_shock.items()
+    }, irf_dict
+
+
 def get_irf_endo_vars(oo_: mat_struct, M_: mat_struct) -> dict[str, list[str]]:
     """Extract a list of endogenous variables used in IRFs for each shock.
 
@@ -86,67 +156,36 @@ def get_irf_endo_vars(oo_: mat_struct, M_: mat_struct) -> dict[str, list[str]]:
         A dictionary mapping each exogenous shock name to a list of endogenous variables that have IRFs.
 
     """
-    irfs = oo_.irfs
-
-    # Get variable names and shock names
-    endo_names = get_endo_names(M_, long=False)
-    exo_names = get_exo_names(M_, long=False)
-
-    # Convert IRF data to a dictionary
-    irf_dict = {
-        name: getattr(irfs, name)
-        for name in dir(irfs)
-        if not name.startswith("__") and isinstance(getattr(irfs, name), np.ndarray)
-    }
-
-    # Group IRFs by shock (names only, no data)
-    used_vars_by_shock = defaultdict(list)
-    for full_name in irf_dict:
-        for shock in exo_names:
-            if full_name.endswith(f"_{shock}"):
-                var = full_name[: -(len(shock) + 1)]
-                if var in endo_names:
-                    used_vars_by_shock[shock].append(var)
-                break
+    used_vars_by_shock, _ = _group_irfs(oo_, M_)
+    return used_vars_by_shock
 
-    # Remove duplicates and sort (optional)
-    for shock in used_vars_by_shock:
-        used_vars_by_shock[shock] = sorted(set(used_vars_by_shock[shock]))
 
-    if not used_vars_by_shock:
-        msg = "No IRF variable names found for the given shocks."
-        raise ValueError(msg)
-
-    return dict(used_vars_by_shock)
-
-
-def get_irf(oo_: mat_struct, M_: mat_struct) -> dict[str, pd.DataFrame]:
+def get_irf(
+    oo_: mat_struct,
+    M_: mat_struct,
+    dtype: np.dtype | None = None,
+) -> dict[str, pd.DataFrame]:
     """Extract IRF data from the oo_ object using endo_names and exo_names from M_,
 
     and return a dictionary of DataFrames indexed by shock name.
-    """
-    irfs = oo_.irfs
 
-    # Convert IRF data to a dictionary
-    irf_dict = {
-        name: getattr(irfs, name)
-        for name in dir(irfs)
-        if not name.startswith("__") and isinstance(getattr(irfs, name), np.ndarray)
-    }
-
-    # Get variable names used in IRFs (dependent function)
-    used_vars_by_shock = get_irf_endo_vars(oo_, M_)
+    Pass dtype (e.g. np.float32) to downcast the IRFs and halve the bytes
+    moved through plotting and serialization; Dynare's float64 precision
+    is well beyond what plots need.
+    """
+    used_vars_by_shock, irf_dict = _group_irfs(oo_, M_)
 
     # Group IRFs by shock
     shock_dfs = {}
     for shock, vars_for_shock in used_vars_by_shock.items():
-        var_data = {
-            var: irf_dict[f"{var}_{shock}"]
-            for var in vars_for_shock
-            if f"{var}_{shock}" in irf_dict
-        }
-        if var_data:
-            shock_dfs[shock] = pd.DataFrame(var_data)
+        cols = [var for var in vars_for_shock if f"{var}_{shock}" in irf_dict]
+        if cols:
+            # All IRFs of one shock share dtype and length, so one stack
+            # beats pandas' per-column dict-of-arrays path
+            mat = np.column_stack([irf_dict[f"{var}_{shock}"] for var in cols])
+            if dtype is not None:
+                mat = mat.astype(dtype, copy=False)
+            shock_dfs[shock] = pd.DataFrame(mat, columns=cols, copy=False)
 
     if not shock_dfs:
         msg = "No IRF data found for the given shocks."
@@ -155,18 +194,59 @@ def get_irf(oo_: mat_struct, M_: mat_struct) -> dict[str, pd.DataFrame]:
     return shock_dfs
 
 
+def get_irf_ndarray(
+    oo_: mat_struct,
+    M_: mat_struct,
+    dtype: np.dtype | None = None,
+) -> dict[str, tuple[np.ndarray, list[str]]]:
+    """Extract IRF data as (2-D array, column names) pairs per shock.
+
+    Skips DataFrame construction entirely for callers that only need the
+    raw matrices; plot_irf_df accepts these pairs directly. As with
+    get_irf, dtype optionally downcasts the stacked arrays.
+    """
+    used_vars_by_shock, irf_dict = _group_irfs(oo_, M_)
+
+    shock_arrays = {}
+    for shock, vars_for_shock in used_vars_by_shock.items():
+        cols = [var for var in vars_for_shock if f"{var}_{shock}" in irf_dict]
+        if cols:
+            mat = np.column_stack([irf_dict[f"{var}_{shock}"] for var in cols])
+            if dtype is not None:
+                mat = mat.astype(dtype, copy=False)
+            shock_arrays[shock] = (mat, cols)
+
+    if not shock_arrays:
+        msg = "No IRF data found for the given shocks."
+        raise ValueError(msg)
+
+    return shock_arrays
+
+
+@functools.lru_cache(maxsize=8)
+def _name_maps(_M_id: int, M_: mat_struct) -> dict[str, dict[str, str]]:
+    """Build short<->long lookup dicts for one M_ struct.
+
+    Keyed by id(M_) so every convert call on the same struct reuses the
+    maps instead of rebuilding the name lists and scanning them linearly.
+    """
+    endo_short, endo_long = get_endo_names_all(M_)
+    exo_short, exo_long = get_exo_names_all(M_)
+    return {
+        "endo_s2l": dict(zip(endo_short, endo_long, strict=False)),
+        "endo_l2s": dict(zip(endo_long, endo_short, strict=False)),
+        "exo_s2l": dict(zip(exo_short, exo_long, strict=False)),
+        "exo_l2s": dict(zip(exo_long, exo_short, strict=False)),
+    }
+
+
 def to_endo_name_long(short_name: str, M_: mat_struct) -> str:
     """Convert a short variable name to its long name using M_.endo_names and M_.endo_names_long."""
-    # Extract name lists and convert to strings
-    short, long = get_endo_names_all(M_)
-
-    # Search without using a dictionary
     try:
-        idx = short.index(short_name)
-        return long[idx]
-    except ValueError as err:
+        return _name_maps(id(M_), M_)["endo_s2l"][short_name]
+    except KeyError:
         msg = "Variable name not found in M_.endo_names."
-        raise KeyError(msg) from err
+        raise KeyError(msg) from None
 
 
 def to_endo_name_short(long_name: str, M_: mat_struct) -> str:
@@ -174,14 +254,9 @@ def to_endo_name_short(long_name: str, M_: mat_struct) -> str:
 
     using M_.endo_names and M_.endo_names_long.
     """
-    # Extract name lists and convert to strings
-    short, long = get_endo_names_all(M_)
-
-    # Search without using a dictionary
     try:
-        idx = long.index(long_name)
-        return short[idx]
-    except ValueError:
+        return _name_maps(id(M_), M_)["endo_l2s"][long_name]
+    except KeyError:
         msg = f"Variable name '{long_name}' was not found in M_.endo_names_long."
         raise KeyError(msg) from None
 
@@ -191,16 +266,9 @@ def to_exo_name_long(short_name: str, M_: mat_struct) -> str:
 
     using M_.exo_names and M_.exo_names_long.
     """
-    # Extract name lists and convert to strings
-    short, long = get_exo_names_all(M_)
-
     try:
-        idx = short.index(short_name)
-        if short[idx] == long[idx]:
-            return short_name
-        return long[idx]
-
-    except ValueError:
+        return _name_maps(id(M_), M_)["exo_s2l"][short_name]
+    except KeyError:
         msg = f"Shock name '{short_name}' was not found in M_.exo_names."
         raise KeyError(msg) from None
 
@@ -210,20 +278,22 @@ def to_exo_name_short(long_name: str, M_: mat_struct) -> str:
 
     using M_.exo_names and M_.exo_names_long.
     """
-    # Extract name lists and convert to strings
-    short, long = get_exo_names_all(M_)
-
     try:
-        idx = long.index(long_name)
-        if short[idx] == long[idx]:
-            return long_name
-        return short[idx]
-
-    except ValueError:
+        return _name_maps(id(M_), M_)["exo_l2s"][long_name]
+    except KeyError:
         msg = f"Shock name '{long_name}' was not found in M_.exo_names_long."
         raise KeyError(msg) from None
 
 
+# Dispatch table for convert(); one dict probe instead of nested branches
+_CONVERTERS = {
+    ("endo", "short"): to_endo_name_short,
+    ("endo", "long"): to_endo_name_long,
+    ("exo", "short"): to_exo_name_short,
+    ("exo", "long"): to_exo_name_long,
+}
+
+
 def convert(name: str, M_: mat_struct, vartype: str, length: str) -> str:
     """Convert endogenous or exogenous variable names to short or long names.
 
@@ -244,26 +314,20 @@ def convert(name: str, M_: mat_struct, vartype: str, length: str) -> str:
         The converted variable name.
 
     """
-    msg = "length must be 'short' or 'long'."
-    if vartype == "endo":
-        if length == "short":
-            return to_endo_name_short(name, M_)
-        if length == "long":
-            return to_endo_name_long(name, M_)
-        raise ValueError(msg)
-    if vartype == "exo":
-        if length == "short":
-            return to_exo_name_short(name, M_)
-        if length == "long":
-            return to_exo_name_long(name, M_)
-        raise ValueError(msg)
-    msg = "vartype must be 'endo' for endogenous or 'exo' for exogenous."
-    raise ValueError(msg)
+    try:
+        converter = _CONVERTERS[(vartype, length)]
+    except KeyError:
+        if vartype not in ("endo", "exo"):
+            msg = "vartype must be 'endo' for endogenous or 'exo' for exogenous."
+            raise ValueError(msg) from None
+        msg = "length must be 'short' or 'long'."
+        raise ValueError(msg) from None
+    return converter(name, M_)
 
 
 def plot_irf_df(
-    df: pd.DataFrame,
-    endo_names: list[str],
+    df: pd.DataFrame | tuple[np.ndarray, list[str]],
+    endo_names: list[str] | None,
     shock_name: str,
     n_cols: int = 3,
     M_: mat_struct = None,
@@ -271,33 +335,71 @@ def plot_irf_df(
     ylabel: str | None = None,
     suptitle: str | None = None,
     irf_threshold: float = 1e-10,
+    fig: Figure | None = None,
 ) -> Figure:
-    irf_df = df[endo_names]
+    # Work on one 2-D array instead of re-selecting DataFrame columns;
+    # (array, names) pairs from get_irf_ndarray are accepted as-is.
+    # endo_names=None (or the full column list) plots everything and
+    # skips the selection copy
+    if isinstance(df, tuple):
+        arr, cols = df
+        columns = list(cols) if endo_names is None else list(endo_names)
+        if columns == list(cols):
+            mat = arr
+        else:
+            col_idx = {name: i for i, name in enumerate(cols)}
+            mat = arr[:, [col_idx[name] for name in columns]]
+    else:
+        all_cols = df.columns.tolist()
+        columns = all_cols if endo_names is None else list(endo_names)
+        if columns == all_cols:
+            mat = df.to_numpy(copy=False)
+        else:
+            mat = df.loc[:, columns].to_numpy(copy=False)
 
-    # For each column, if max(abs(series)) < irf_threshold, set all values to 0
-    for col in irf_df.columns:
-        arr = irf_df[col].to_numpy().copy()
-        if np.nanmax(np.abs(arr)) < irf_threshold:
-            arr[:] = 0
-            irf_df[col] = arr
+    # Zero out columns whose max(abs(series)) < irf_threshold, in one pass
+    zero_cols = np.nanmax(np.abs(mat), axis=0) < irf_threshold
+    if zero_cols.any():
+        mat = mat.copy()
+        mat[:, zero_cols] = 0
 
-    n_series = irf_df.shape[1]  # Number of series (columns)
+    n_series = mat.shape[1]  # Number of series (columns)
     n_rows = math.ceil(n_series / n_cols)
 
-    fig, axes = plt.subplots(n_rows, n_cols, figsize=(5 * n_cols, 3 * n_rows))
-    axes = np.array(axes).reshape(-1)  # Flatten axes for easier handling
-
-    for i, col in enumerate(irf_df.columns):
-        if M_ is not None:
-            # If M_ is specified, convert to long name
-            title = convert(col, M_, vartype="endo", length="long")
-            if suptitle is None:
-                # If suptitle is not specified, convert shock name to long name
-                suptitle = convert(shock_name, M_, vartype="exo", length="long")
+    # Reuse the caller's figure when its grid matches, clearing each axis;
+    # batch loops over shocks then skip re-allocating the subplot grid
+    if fig is not None and len(fig.axes) == n_rows * n_cols:
+        axes = np.asarray(fig.axes).ravel()
+        for ax in axes:
+            ax.cla()
+            ax.set_visible(True)  # cla() keeps visibility from a prior call
+    else:
+        if fig is None:
+            # Imported here so load/get_irf callers never pay for matplotlib
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            # Build the figure outside pyplot so it is never registered with
+            # the global figure manager; st.pyplot accepts a plain Figure
+            fig = Figure(figsize=(5 * n_cols, 3 * n_rows), constrained_layout=True)
+            FigureCanvasAgg(fig)
         else:
-            title = col
+            fig.clf()
+        # squeeze=False always yields a 2-D array, so ravel() is a free view
+        axes = fig.subplots(n_rows, n_cols, squeeze=False).ravel()
+
+    if M_ is not None:
+        # If M_ is specified, convert all titles to long names up front
+        titles = [convert(col, M_, vartype="endo", length="long") for col in columns]
+        if suptitle is None:
+            # If suptitle is not specified, convert shock name to long name
+            suptitle = convert(shock_name, M_, vartype="exo", length="long")
+    else:
+        titles = columns
+
+    for i, title in enumerate(titles):
         ax = axes[i]
-        ax.plot(irf_df[col])
+        ax.plot(mat[:, i])
         ax.set_title(title)
         ax.axhline(0, color="gray", linestyle="--")
         ax.grid()
@@ -314,7 +416,6 @@ def plot_irf_df(
         axes[j].set_visible(False)
 
     fig.suptitle(f"Impulse Responses to {suptitle}", fontsize=16)
-    fig.tight_layout(rect=[0, 0, 1, 0.95])
     return fig
 
 
@@ -332,6 +433,8 @@ def dump_figure(fig: Figure) -> bytes:
         The pickled bytes representation of the figure and related info.
 
     """
+    import matplotlib as mpl
+
     info = {
         "figure": fig,
         "matplotlib_version": mpl.__version__,
@@ -351,8 +454,8 @@ def main() -> None:
 
     df = shock_dfs["eps_u"]  # noqa: PD901
 
-    plot_irf_df(df, df.columns, "eps_u", M_=M_, n_cols=2)
-    plt.show()
+    fig = plot_irf_df(df, df.columns, "eps_u", M_=M_, n_cols=2)
+    fig.savefig("irf_eps_u.png")
 
 
 if __name__ == "__main__":